@@ -3,24 +3,43 @@
 
 import os
 import sys
-from obspy import UTCDateTime
-from datetime import datetime
+
+from lib.catalog import Catalog
 
 BASE = "/data/Level1/CENC"
 DIRROOT = "CENC"
+HEADER = "id,date,time,evla,evlo,evdp,mag,imagtyp,dir"
+
+
+def database_entries(catalog, dirroot=DIRROOT):
+    """Yield event id, database entry and catalog line of each event
+    """
+    for id, text, event in zip(catalog.ids, catalog.text, catalog.events):
+        date, time = text['origin'].split('T')
+        entry = ",".join([id, date, time, text['latitude'], text['longitude'],
+                          text['depth'], text['magnitude'],
+                          event['magnitude_type'], os.path.join(dirroot, id)])
+        yield id, entry, text['line']
+
 
-if len(sys.argv) != 2:
-    sys.exit("Usage: python {} events.csv".format(sys.argv[0]))
-
-catalog = sys.argv[1]
-print("id,date,time,evla,evlo,evdp,mag,imagtyp,dir")
-with open(catalog, "r") as f:
-    for line in f:
-        origin, evla, evlo, evdp, mag, imagtyp = line.strip().split()
-        date, time = origin.split('T')
-        id = UTCDateTime(origin).strftime("%Y%m%d%H%M%S")
-        entry = ",".join([id, date, time, evla, evlo, evdp, mag, imagtyp, os.path.join(DIRROOT, id)])
-        if os.path.exists(os.path.join(BASE, id)):
-            print(entry)
+def catalog2database(catalog, base=BASE, dirroot=DIRROOT,
+                     out=sys.stdout, err=sys.stderr):
+    """Write database entries of released events in catalog
+
+    Events without data directory in base are written to err.
+    """
+    if not isinstance(catalog, Catalog):
+        catalog = Catalog(catalog)
+    print(HEADER, file=out)
+    for id, entry, line in database_entries(catalog, dirroot):
+        if os.path.exists(os.path.join(base, id)):
+            print(entry, file=out)
         else:
-            print(line, end='', file=sys.stderr)
+            print(line, file=err)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python {} events.csv".format(sys.argv[0]))
+
+    catalog2database(sys.argv[1])
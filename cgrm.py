@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+# -*- coding:utf8 -*-
+"""
+Command line entry point of CGRM-DMC scripts.
+
+Usage:
+
+    python cgrm.py [--config cgrm.cfg] SUBCOMMAND [options]
+
+Subcommands:
+
+    cut            trim event waveform from continuous miniSEED (mseed2sac.py)
+    responses      collect response files of each event
+                   (event_response_spider.py)
+    database       convert event catalog to database.csv
+                   (catalog2database.py)
+    check-headers  fix station location headers of Level1 data
+                   (check_header.pl)
+    mismatch       list events with response but no waveform
+                   (check_mismatch.pl)
+    manifest       list all SAC files of Level1 data (path_info.pl)
+    qc             collect quality metrics of events into SQLite
+    watch          cut and publish new events and new station-days
+    serve          local HTTP service trimming waveform on demand
+    merge          check completeness of cut or responses run in shards
+
+Options may also be given in a config file, with one section per
+subcommand, and options given in command line take precedence:
+
+    [DEFAULT]
+    catalog = ./catalog_released.csv
+
+    [cut]
+    stationinfo = ./info/station.info
+    mseeddir = /data/mseed
+    sacdir = /data/Level1/CENC
+    duration = 6000
+
+ObsPy, TauP and NumPy are only imported by the subcommands using them, so
+that cheap subcommands start fast.
+"""
+import os
+import sys
+import argparse
+import configparser
+
+# width of taper at each end before detrending or filtering
+DEFAULT_TAPER = 0.05
+
+
+def add_selection(parser):
+    """Options to select events from catalog
+    """
+    group = parser.add_argument_group("event selection")
+    group.add_argument("--catalog", default="./catalog_released.csv",
+                       help="event catalog (default: %(default)s)")
+    group.add_argument("--starttime", help="minimum origin time")
+    group.add_argument("--endtime", help="maximum origin time")
+    for name, desc in [("magnitude", "magnitude"), ("depth", "depth in km"),
+                       ("latitude", "latitude"), ("longitude", "longitude"),
+                       ("radius", "distance in degree from CGRM network")]:
+        group.add_argument("--min" + name, type=float,
+                           help="minimum " + desc)
+        group.add_argument("--max" + name, type=float,
+                           help="maximum " + desc)
+
+
+def selection(args):
+    """Return keyword arguments of Catalog.select from add_selection options
+    """
+    keys = ["starttime", "endtime"]
+    for name in ["magnitude", "depth", "latitude", "longitude", "radius"]:
+        keys += ["min" + name, "max" + name]
+    return {key: getattr(args, key) for key in keys}
+
+
+def select_events(args):
+    """Return events selected by options of add_selection
+    """
+    from lib.catalog import Catalog
+
+    return Catalog(args.catalog).select(**selection(args))
+
+
+def split_list(string):
+    """Parse comma separated list
+    """
+    return [item.strip() for item in string.split(",") if item.strip()]
+
+
+def split_floats(string):
+    """Parse comma separated list of float
+    """
+    return [float(item) for item in split_list(string)]
+
+
+def make_client(args):
+    """Return mseed2sac.Client from options of add_cut_options
+    """
+    from mseed2sac import Client
+
+    if not args.mseeddir:
+        sys.exit("{}: mseeddir is required".format(args.command))
+
+    response = None
+    if args.remove_response:
+        from lib.respider import SourceResponse
+        response = SourceResponse(subdir=args.respdir)
+
+    return Client(stationinfo=args.stationinfo,
+                  mseeddir=args.mseeddir,
+                  sacdir=args.sacdir,
+                  model=args.model,
+                  qc=args.qc,
+                  response=response,
+                  output=args.remove_response,
+                  water_level=args.water_level,
+                  pre_filt=args.pre_filt)
+
+
+def make_windows(args):
+    """Return by_event, by_phase and epicenter of Client.get_waveform
+    """
+    by_event, by_phase, epicenter = None, None, None
+    if args.window == "event":
+        by_event = {"start_offset": args.start_offset,
+                    "duration": args.duration}
+    else:
+        by_phase = {
+            "start_ref_phase": args.start_ref_phase,
+            "start_offset": args.start_offset,
+            "end_ref_phase": args.end_ref_phase,
+            "end_offset": args.end_offset
+        }
+    if args.mindist is not None or args.maxdist is not None:
+        epicenter = {
+            "minimum": args.mindist if args.mindist is not None else 0,
+            "maximum": args.maxdist if args.maxdist is not None else 180
+        }
+    return by_event, by_phase, epicenter
+
+
+def make_preprocess(args):
+    """Return preprocess of Client.get_waveform, None if nothing to do
+    """
+    filtering = args.detrend or args.freqmin or args.freqmax
+    if not (filtering or args.taper or args.resample or args.rotate):
+        return None
+    taper_width = args.taper
+    if taper_width is None:
+        taper_width = DEFAULT_TAPER if filtering else 0
+    return {"detrend_data": args.detrend,
+            "taper_width": taper_width,
+            "freqmin": args.freqmin,
+            "freqmax": args.freqmax,
+            "corners": args.corners,
+            "zerophase": not args.causal,
+            "sampling_rate": args.resample,
+            "rotate": args.rotate}
+
+
+def run_events(args, process, leasedir, settings):
+    """Run process on selected events, or on tasks of a shard
+
+    settings are options determining the output, tasks done with other
+    settings in the same lease directory are not regarded as done.
+    """
+    catalog = select_events(args)
+    if not args.shard:
+        process(catalog)
+        return
+
+    from lib.shard import parse_shard, shard_tasks, run_tasks, check_settings
+
+    leasedir = args.leasedir or leasedir
+    try:
+        shard = parse_shard(args.shard)
+        check_settings(leasedir, dict(settings, shard_by=args.shard_by))
+    except ValueError as e:
+        sys.exit("{}: {}".format(args.command, e))
+    tasks = shard_tasks(catalog, by=args.shard_by, shard=shard)
+    count = run_tasks(tasks, leasedir, process, ttl=args.lease_ttl)
+    print("{} of {} tasks in shard {} done by this host".format(
+        count, len(tasks), args.shard))
+
+
+def cut(args):
+    from tqdm import tqdm
+    from mseed2sac import logger
+
+    client = make_client(args)
+    by_event, by_phase, epicenter = make_windows(args)
+    preprocess = make_preprocess(args)
+
+    def process(events):
+        for event in tqdm(events):
+            logger.info("origin: %s", event['origin'])
+            client.get_waveform(event, by_event=by_event, by_phase=by_phase,
+                                epicenter=epicenter, preprocess=preprocess)
+
+    settings = {"stationinfo": args.stationinfo, "mseeddir": args.mseeddir,
+                "model": args.model, "by_event": by_event,
+                "by_phase": by_phase, "epicenter": epicenter, "qc": args.qc,
+                "output": args.remove_response,
+                "water_level": args.water_level, "pre_filt": args.pre_filt,
+                "preprocess": preprocess}
+    run_events(args, process, os.path.join(args.sacdir, ".leases"),
+               settings)
+
+
+def watch(args):
+    from lib.watch import Watcher
+
+    if args.window != "event":
+        sys.exit("watch: only --window event is supported")
+
+    client = make_client(args)
+    by_event, _, epicenter = make_windows(args)
+
+    sourceresponse = None
+    if args.respout:
+        from lib.respider import SourceResponse
+        sourceresponse = SourceResponse(subdir=args.respdir)
+
+    watcher = Watcher(client, args.catalog, args.state, by_event,
+                      selection=selection(args), epicenter=epicenter,
+                      sourceresponse=sourceresponse, respdir=args.respout,
+                      database=args.database, dirroot=args.dirroot)
+    if args.init:
+        watcher.initialize()
+    elif args.once:
+        watcher.poll()
+    else:
+        watcher.run(interval=args.interval)
+
+
+def responses(args):
+    from lib.respider import SourceResponse, logger
+    from event_response_spider import event_assign
+
+    sourceresponse = SourceResponse(subdir=args.respdir)
+
+    def process(events):
+        for event in events:
+            origin = event["origin"]
+            event_assign(origin, sourceresponse, export_dir=args.outdir)
+            logger.info("Fini. {}".format(origin.strftime("%Y%m%d%H%M%S")))
+
+    run_events(args, process, os.path.join(args.outdir, ".leases"),
+               {"respdir": args.respdir})
+
+
+def merge(args):
+    from lib.shard import task_keys, check_completeness, shard_of, Lease
+
+    if not args.leasedir:
+        sys.exit("merge: leasedir is required")
+    keys = task_keys(select_events(args), by=args.shard_by)
+    status = check_completeness(keys, args.leasedir, ttl=args.lease_ttl)
+    if args.clean_stale:
+        for key in status["stale"]:
+            Lease(args.leasedir, key, args.lease_ttl).break_stale()
+    rerun = set()
+    for name in ["running", "stale", "missing"]:
+        for key in status[name]:
+            if args.shards:
+                shard = "{}/{}".format(shard_of(key, args.shards), args.shards)
+                print("{} {} shard {}".format(name, key, shard))
+                if name != "running":
+                    rerun.add(shard)
+            else:
+                print("{} {}".format(name, key))
+    print("{} of {} tasks done".format(len(status["done"]), len(set(keys))))
+    # tasks are never run by other shards, rerun shards of unfinished tasks
+    if rerun:
+        print("rerun with --shard {}".format(" ".join(sorted(rerun))))
+    if len(status["done"]) != len(set(keys)):
+        sys.exit(1)
+
+
+def database(args):
+    from catalog2database import catalog2database
+
+    if args.output:
+        with open(args.output, "w") as f:
+            catalog2database(select_events(args), args.base, args.dirroot,
+                             out=f)
+    else:
+        catalog2database(select_events(args), args.base, args.dirroot)
+
+
+def check_headers(args):
+    from lib.level1 import check_headers
+
+    modified = check_headers(args.datadir, args.revision)
+    print("{} files modified".format(modified))
+
+
+def mismatch(args):
+    from lib.level1 import find_mismatch
+
+    with open(args.output, "a") as f:
+        for event in find_mismatch(args.datadir, args.respdir):
+            print(event, file=f)
+
+
+def manifest(args):
+    from lib.level1 import manifest
+
+    out = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for filename in manifest(args.datadir, args.pattern):
+            print(filename, file=out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def qc(args):
+    from lib.qc import build_index
+
+    count = build_index(args.sacdir, args.database)
+    print("{} traces indexed".format(count))
+
+
+def add_cut_options(sub):
+    """Options to trim waveform with mseed2sac.Client
+    """
+    sub.add_argument("--stationinfo", default="./info/station.info",
+                     help="station information (default: %(default)s)")
+    sub.add_argument("--mseeddir", help="continuous miniSEED directory")
+    sub.add_argument("--sacdir", default="SAC",
+                     help="output SAC directory (default: %(default)s)")
+    sub.add_argument("--model", default="prem",
+                     help="TauP model (default: %(default)s)")
+    sub.add_argument("--window", choices=["event", "phase"], default="event",
+                     help="determine window by origin time or phase arrivals")
+    sub.add_argument("--start-offset", type=float, default=0,
+                     help="offset of starttime in second")
+    sub.add_argument("--duration", type=float, default=6000,
+                     help="window length in second, for --window event")
+    sub.add_argument("--start-ref-phase", type=split_list, default="P,p",
+                     help="phases of starttime, for --window phase")
+    sub.add_argument("--end-ref-phase", type=split_list, default="PcP",
+                     help="phases of endtime, for --window phase")
+    sub.add_argument("--end-offset", type=float, default=0,
+                     help="offset of endtime in second, for --window phase")
+    sub.add_argument("--mindist", type=float,
+                     help="minimum epicentral distance in degree")
+    sub.add_argument("--maxdist", type=float,
+                     help="maximum epicentral distance in degree")
+    sub.add_argument("--qc", action="store_true",
+                     help="write quality metrics to qc.csv of each event")
+    sub.add_argument("--remove-response", choices=["DISP", "VEL", "ACC"],
+                     help="remove instrument response to given output")
+    sub.add_argument("--respdir", default="./info/Response",
+                     help="response files directory (default: %(default)s)")
+    sub.add_argument("--water-level", type=float, default=60.0,
+                     help="water level in dB (default: %(default)s)")
+    sub.add_argument("--pre-filt", type=split_floats,
+                     help="corners f1,f2,f3,f4 of frequency taper in Hz")
+
+
+def serve(args):
+    from lib.service import CutService, serve
+
+    service = CutService(make_client(args), args.catalog, args.cachedir,
+                         cache_size=int(args.cache_size * 1024 ** 2),
+                         max_jobs=args.max_jobs)
+    serve(service, host=args.host, port=args.port)
+
+
+def add_preprocess_options(sub):
+    """Options to preprocess traces of each event together
+    """
+    group = sub.add_argument_group("preprocessing")
+    group.add_argument("--detrend", action="store_true",
+                       help="remove mean and linear trend")
+    group.add_argument("--taper", type=float,
+                       help="width of taper at each end (default: {} when "
+                            "detrending or filtering, else no taper)".format(
+                                DEFAULT_TAPER))
+    group.add_argument("--freqmin", type=float,
+                       help="lower corner of Butterworth filter in Hz")
+    group.add_argument("--freqmax", type=float,
+                       help="upper corner of Butterworth filter in Hz")
+    group.add_argument("--corners", type=int, default=4,
+                       help="order of filter (default: %(default)s)")
+    group.add_argument("--causal", action="store_true",
+                       help="filter forward only instead of zero phase")
+    group.add_argument("--resample", type=float,
+                       help="sampling rate to resample to in Hz")
+    group.add_argument("--rotate", action="store_true",
+                       help="rotate E and N components to R and T")
+
+
+def add_shard_options(sub):
+    """Options to share a catalog among hosts
+    """
+    group = sub.add_argument_group("sharding")
+    group.add_argument("--shard",
+                       help="run shard i of N (i/N, 0 <= i < N) with lease "
+                            "files, so that hosts do not overlap")
+    group.add_argument("--shard-by", choices=["event", "day"],
+                       default="event",
+                       help="task of sharding (default: %(default)s)")
+    group.add_argument("--leasedir",
+                       help="directory of lease files on shared filesystem "
+                            "(default: .leases in output directory)")
+    group.add_argument("--lease-ttl", type=float, default=3600,
+                       help="seconds after which a lease is stale "
+                            "(default: %(default)s)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cgrm", description="Manage CGRM-DMC database")
+    parser.add_argument("-c", "--config",
+                        help="config file with one section per subcommand")
+    subparsers = parser.add_subparsers(dest="command", metavar="SUBCOMMAND")
+    subparsers.required = True
+
+    # cut
+    sub = subparsers.add_parser("cut", help="trim event waveform")
+    add_cut_options(sub)
+    add_preprocess_options(sub)
+    add_shard_options(sub)
+    add_selection(sub)
+    sub.set_defaults(func=cut)
+
+    # responses
+    sub = subparsers.add_parser("responses",
+                                help="collect response files of events")
+    sub.add_argument("--respdir", default="./info/Response",
+                     help="response files directory (default: %(default)s)")
+    sub.add_argument("--outdir", default="./event",
+                     help="output directory (default: %(default)s)")
+    add_shard_options(sub)
+    add_selection(sub)
+    sub.set_defaults(func=responses)
+
+    # database
+    sub = subparsers.add_parser("database",
+                                help="convert event catalog to database.csv")
+    sub.add_argument("--base", default="/data/Level1/CENC",
+                     help="released event directory (default: %(default)s)")
+    sub.add_argument("--dirroot", default="CENC",
+                     help="dir column prefix (default: %(default)s)")
+    sub.add_argument("-o", "--output", help="output file (default: stdout)")
+    add_selection(sub)
+    sub.set_defaults(func=database)
+
+    # check-headers
+    sub = subparsers.add_parser("check-headers",
+                                help="fix station headers of Level1 data")
+    sub.add_argument("--datadir", default="/data/Level1/CENC",
+                     help="released event directory (default: %(default)s)")
+    sub.add_argument("--revision", default="./info/station.revision.txt",
+                     help="station revisions (default: %(default)s)")
+    sub.set_defaults(func=check_headers)
+
+    # mismatch
+    sub = subparsers.add_parser("mismatch",
+                                help="events with response but no waveform")
+    sub.add_argument("--datadir", default="/data/Level1/CENC",
+                     help="released event directory (default: %(default)s)")
+    sub.add_argument("--respdir", default="/data/Level1/Response",
+                     help="released response directory "
+                          "(default: %(default)s)")
+    sub.add_argument("-o", "--output", default="./info/mismatch.txt",
+                     help="file to append to (default: %(default)s)")
+    sub.set_defaults(func=mismatch)
+
+    # manifest
+    sub = subparsers.add_parser("manifest", help="list SAC files of Level1")
+    sub.add_argument("--datadir", default="/data/Level1/CENC",
+                     help="released event directory (default: %(default)s)")
+    sub.add_argument("--pattern", default="*.SAC",
+                     help="data file pattern (default: %(default)s)")
+    sub.add_argument("-o", "--output",
+                     help="file to append to (default: stdout)")
+    sub.set_defaults(func=manifest)
+
+    # qc
+    sub = subparsers.add_parser("qc", help="index quality metrics of events")
+    sub.add_argument("--sacdir", default="SAC",
+                     help="directory of events (default: %(default)s)")
+    sub.add_argument("--database",
+                     help="SQLite database (default: SACDIR/qc.sqlite)")
+    sub.set_defaults(func=qc)
+
+    # watch
+    sub = subparsers.add_parser("watch",
+                                help="cut and publish new events as they "
+                                     "arrive")
+    add_cut_options(sub)
+    sub.add_argument("--state", default="./watch.json",
+                     help="state file (default: %(default)s)")
+    sub.add_argument("--interval", type=float, default=60,
+                     help="seconds between polls (default: %(default)s)")
+    sub.add_argument("--respout",
+                     help="output directory of response files of events, "
+                          "not collected if omitted")
+    sub.add_argument("--database", default="./database.csv",
+                     help="database.csv to append to (default: %(default)s)")
+    sub.add_argument("--dirroot", default="CENC",
+                     help="dir column prefix (default: %(default)s)")
+    sub.add_argument("--init", action="store_true",
+                     help="regard current catalog and archive as processed")
+    sub.add_argument("--once", action="store_true",
+                     help="poll once and exit")
+    add_selection(sub)
+    sub.set_defaults(func=watch)
+
+    # serve
+    sub = subparsers.add_parser("serve",
+                                help="trim waveform on demand over HTTP")
+    add_cut_options(sub)
+    sub.add_argument("--catalog", default="./catalog_released.csv",
+                     help="event catalog (default: %(default)s)")
+    sub.add_argument("--host", default="127.0.0.1",
+                     help="address to bind (default: %(default)s)")
+    sub.add_argument("--port", type=int, default=8000,
+                     help="port to bind (default: %(default)s)")
+    sub.add_argument("--cachedir", default="./cache",
+                     help="directory of cached results "
+                          "(default: %(default)s)")
+    sub.add_argument("--cache-size", type=float, default=2048,
+                     help="maximum size of cache in MB "
+                          "(default: %(default)s)")
+    sub.add_argument("--max-jobs", type=int, default=2,
+                     help="maximum concurrent trimming jobs "
+                          "(default: %(default)s)")
+    sub.set_defaults(func=serve)
+
+    # merge
+    sub = subparsers.add_parser("merge",
+                                help="check completeness of sharded runs")
+    add_shard_options(sub)
+    sub.add_argument("--shards", type=int,
+                     help="number of shards N of the run, to report the "
+                          "shard to rerun of each task not done")
+    sub.add_argument("--clean-stale", action="store_true",
+                     help="remove stale leases so that tasks can be rerun")
+    add_selection(sub)
+    sub.set_defaults(func=merge)
+
+    return parser, subparsers
+
+
+def read_config(configfile, section, flags=()):
+    """Return options of section (and DEFAULT) in config file
+
+    Options in flags are read as booleans (yes/no, true/false, on/off, 1/0).
+    """
+    config = configparser.ConfigParser()
+    if not config.read(configfile):
+        sys.exit("Can't read config file {}".format(configfile))
+    if not config.has_section(section):
+        section = config.default_section
+    options = {}
+    for key, value in config.items(section):
+        dest = key.replace("-", "_")
+        if dest in flags:
+            try:
+                value = config.getboolean(section, key)
+            except ValueError:
+                sys.exit("{}: {} should be a boolean, got {}".format(
+                    configfile, key, value))
+        options[dest] = value
+    return options
+
+
+def flag_options(parser):
+    """Return dest of options taking no argument, e.g. store_true
+    """
+    return {action.dest for action in parser._actions
+            if action.nargs == 0 and isinstance(action.const, bool)}
+
+
+def main(argv=None):
+    parser, subparsers = build_parser()
+    args = parser.parse_args(argv)
+
+    # options in config file become defaults of the subcommand, so that
+    # options in command line take precedence
+    if args.config:
+        subparser = subparsers.choices[args.command]
+        subparser.set_defaults(**read_config(args.config, args.command,
+                                             flag_options(subparser)))
+        args = parser.parse_args(argv)
+
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,9 @@
 #      Version: ALPHA
 # Created Date: 15:58h, 31/01/2018
 #        Usage:
-#               python event_response_spider.py
+#               python event_response_spider.py [options]
+#               or python cgrm.py responses [options]
+#               with --shard i/N to share the catalog among hosts
 #
 #
 #       Author: Xiao Xiao, https://github.com/SeisPider
@@ -80,18 +82,8 @@ def rewrite_sacpz(inputfilename, outputfilename):
                 outputf.writelines(line)
 
 if __name__ == '__main__':
-    # import dresponse file location
-    sourceresponse = SourceResponse(subdir="./info/Response")
+    # same as `python cgrm.py responses [options]`
+    import sys
+    from cgrm import main
 
-    # import event info
-    with open("./catalog_released.csv") as f:
-        lines = f.readlines()
-    for line in lines:
-        origin = UTCDateTime(line.split()[0])
-        event_assign(origin, sourceresponse)
-        logger.info("Fini. {}".format(origin.strftime("%Y%m%d%H%M%S")))
-
-        
-
-
-    
+    main(["responses"] + sys.argv[1:])
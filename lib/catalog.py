@@ -0,0 +1,288 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide class to load and query the released event catalog
+#       Usage:
+#              Event catalog is organized as (whitespace separated)
+#
+#                  origin  latitude  longitude  depth  magnitude  [type]
+#                  2016-01-03T23:05:22.270  24.8036   93.6505  55.0 6.7  mww
+#
+#              The parsed catalog is cached next to the catalog file as
+#              .<catalog>.cache.npz and refreshed whenever the catalog
+#              changes.
+#------------------------------------------------------------------------------
+import os
+import logging
+from os.path import join, dirname, basename, getmtime, getsize
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# mseed data are stored according to BJT (UTC+8) not UTC
+BJT_OFFSET = 8 * 3600
+
+# approximate centroid of the CGRM network (latitude, longitude)
+CGRM_CENTER = (35.0, 105.0)
+
+# numeric columns used by queries
+EVENT_DTYPE = np.dtype([
+    ("time", "f8"),           # origin time in epoch seconds (UTC)
+    ("latitude", "f8"),
+    ("longitude", "f8"),
+    ("depth", "f8"),
+    ("magnitude", "f8"),
+    ("magnitude_type", "U8"),
+])
+
+# raw text columns, kept to reproduce the released catalog verbatim; the
+# whole line is kept in an extra "line" field sized to the longest line
+TEXT_DTYPE = np.dtype([
+    ("origin", "U32"),
+    ("latitude", "U16"),
+    ("longitude", "U16"),
+    ("depth", "U16"),
+    ("magnitude", "U16"),
+])
+
+CACHE_VERSION = 2
+
+
+class Catalog(object):
+    """class to handle the event catalog as columns
+    """
+
+    def __init__(self, catalog=None, cache=True, events=None, text=None):
+        """initialize and import the event catalog
+
+        Parameter
+        =========
+        catalog : str or path-like obj.
+            catalog file, e.g. catalog_released.csv
+        cache : bool
+            read and write the parsed catalog from/to disk cache
+        events : `~numpy.ndarray`
+            structured array with EVENT_DTYPE, used instead of catalog
+        text : `~numpy.ndarray`
+            structured array with TEXT_DTYPE matching events
+        """
+        self.catalog = catalog
+        if events is None:
+            events, text = self._load(catalog, cache)
+        self.events = events
+        self.text = text
+
+    def __repr__(self):
+        """representation
+        """
+        return "<Catalog of {} events>".format(len(self))
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        """iterate over events as dict. used by the trimming scripts
+        """
+        from obspy import UTCDateTime
+
+        for event in self.events:
+            yield {
+                "origin": UTCDateTime(float(event["time"])),
+                "latitude": float(event["latitude"]),
+                "longitude": float(event["longitude"]),
+                "depth": float(event["depth"]),
+                "magnitude": float(event["magnitude"]),
+                "magnitude_type": str(event["magnitude_type"]),
+            }
+
+    def __getitem__(self, index):
+        """Return a sub-catalog selected by index, slice or boolean mask
+        """
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 or None)
+        return Catalog(catalog=self.catalog, events=self.events[index],
+                       text=self.text[index])
+
+    @property
+    def ids(self):
+        """event ids (YYYYMMDDHHMMSS of origin time) as used in Level1
+        """
+        seconds = np.floor(self.events["time"]).astype("int64")
+        isot = np.datetime_as_string(seconds.astype("datetime64[s]"))
+        digits = np.char.replace(np.char.replace(isot, "-", ""), ":", "")
+        return np.char.replace(digits, "T", "")
+
+    def _load(self, catalog, cache):
+        """Read catalog from cache if it is up to date, else parse it
+        """
+        cachefile = join(dirname(catalog), "." + basename(catalog) +
+                         ".cache.npz")
+        stamp = np.array([CACHE_VERSION, getmtime(catalog), getsize(catalog)])
+
+        if cache and os.path.exists(cachefile):
+            try:
+                with np.load(cachefile) as data:
+                    if np.array_equal(data["stamp"], stamp):
+                        return data["events"], data["text"]
+            except Exception as e:
+                logger.warning("Ignore broken catalog cache %s: %s",
+                               cachefile, e)
+
+        events, text = read_columns(catalog)
+        if cache:
+            # write to a private file first, other processes may read it
+            tmpfile = "{}.{}.tmp".format(cachefile, os.getpid())
+            try:
+                with open(tmpfile, "wb") as f:
+                    np.savez(f, stamp=stamp, events=events, text=text)
+                os.replace(tmpfile, cachefile)
+            except OSError as e:
+                logger.warning("Can't write catalog cache %s: %s",
+                               cachefile, e)
+        return events, text
+
+    def select(self, starttime=None, endtime=None,
+               minmagnitude=None, maxmagnitude=None,
+               mindepth=None, maxdepth=None,
+               minlatitude=None, maxlatitude=None,
+               minlongitude=None, maxlongitude=None,
+               minradius=None, maxradius=None, center=CGRM_CENTER):
+        """Return events matched all given criteria
+
+        Parameter
+        =========
+        starttime, endtime : `~obspy.UTCDateTime`, str or float
+            origin time range, float values are epoch seconds
+        minmagnitude, maxmagnitude : float
+            magnitude range
+        mindepth, maxdepth : float
+            depth range in km
+        minlatitude, maxlatitude, minlongitude, maxlongitude : float
+            geographic box, longitude box may cross the antimeridian
+            (minlongitude > maxlongitude)
+        minradius, maxradius : float
+            epicentral distance ring in degree around center
+        center : tuple
+            (latitude, longitude) of the ring center, default CGRM network
+        """
+        events = self.events
+        mask = np.ones(len(events), dtype=bool)
+
+        def within(column, minimum, maximum):
+            if minimum is not None:
+                mask[:] &= column >= minimum
+            if maximum is not None:
+                mask[:] &= column <= maximum
+
+        within(events["time"], to_timestamp(starttime), to_timestamp(endtime))
+        within(events["magnitude"], minmagnitude, maxmagnitude)
+        within(events["depth"], mindepth, maxdepth)
+        within(events["latitude"], minlatitude, maxlatitude)
+
+        if minlongitude is not None and maxlongitude is not None \
+                and minlongitude > maxlongitude:
+            mask &= (events["longitude"] >= minlongitude) | \
+                    (events["longitude"] <= maxlongitude)
+        else:
+            within(events["longitude"], minlongitude, maxlongitude)
+
+        if minradius is not None or maxradius is not None:
+            dist = locations2degrees(center[0], center[1],
+                                     events["latitude"], events["longitude"])
+            within(dist, minradius, maxradius)
+
+        return self[mask]
+
+    def get(self, event_id):
+        """Return event dict. of given event id or None
+
+        Parameter
+        =========
+        event_id : str
+            YYYYMMDDHHMMSS of origin time
+        """
+        index = np.flatnonzero(self.ids == event_id)
+        if not len(index):
+            return None
+        return next(iter(self[int(index[0])]))
+
+
+def to_timestamp(time):
+    """convert time to epoch seconds
+
+    Parameter
+    =========
+    time : `~obspy.UTCDateTime`, str, float or None
+    """
+    if time is None:
+        return None
+    if isinstance(time, str):
+        return parse_times([time])[0]
+    if hasattr(time, "timestamp"):
+        timestamp = time.timestamp
+        return timestamp() if callable(timestamp) else timestamp
+    return float(time)
+
+
+def parse_times(origins):
+    """Vectorized parse of ISO origin times into epoch seconds
+
+    Parameter
+    =========
+    origins : list of str
+        e.g. ["2016-01-03T23:05:22.270", "2017-04-28T20:23:17"]
+    """
+    times = np.array(origins, dtype="datetime64[us]")
+    return times.astype("int64") / 1e6
+
+
+def read_columns(catalog):
+    """Parse catalog file into numeric and text structured arrays
+
+    Parameter
+    =========
+    catalog : str or path-like obj.
+        catalog file
+    """
+    rows, lines = [], []
+    with open(catalog, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 5:
+                continue
+            if len(fields) == 5:
+                fields.append("")
+            rows.append(fields[0:6])
+            lines.append(line.rstrip("\r\n"))
+
+    width = max([len(line) for line in lines] + [1])
+    events = np.zeros(len(rows), dtype=EVENT_DTYPE)
+    text = np.zeros(len(rows), dtype=TEXT_DTYPE.descr +
+                    [("line", "U{}".format(width))])
+    if not rows:
+        return events, text
+
+    columns = list(zip(*rows))
+    for name, column in zip(TEXT_DTYPE.names, columns):
+        text[name] = column
+    text["line"] = lines
+    events["time"] = parse_times(columns[0])
+    for name, column in zip(EVENT_DTYPE.names[1:5], columns[1:5]):
+        events[name] = np.array(column, dtype=float)
+    events["magnitude_type"] = columns[5]
+    logger.info("%d events in catalog %s", len(rows), catalog)
+    return events, text
+
+
+def locations2degrees(lat1, lon1, lat2, lon2):
+    """Vectorized great circle distance in degree
+
+    Parameter
+    =========
+    lat1, lon1, lat2, lon2 : float or `~numpy.ndarray`
+        locations in degree
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    hav = np.sin((lat2 - lat1) / 2.0) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return np.degrees(2.0 * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0))))
@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide helpers to maintain the released Level1 database
+#       Usage:
+#              Level1 database is organized as
+#              ├── CENC
+#              │   ├── YYYYMMDDHHMMSS
+#              │   │   ├── YYYY.JDAY.HH.MM.SS.0000.NET.STA.LOC.CHA.M.SAC
+#              └── Response
+#                  ├── YYYYMMDDHHMMSS
+#                  │   ├── PZs_NET_STA_LOC_CHA
+#
+#              Python versions of check_mismatch.pl, path_info.pl and
+#              check_header.pl. Only the header checker needs ObsPy.
+#------------------------------------------------------------------------------
+import os
+import logging
+from glob import glob
+from os.path import join, basename, isdir
+
+logger = logging.getLogger(__name__)
+
+
+def find_mismatch(datadir, respdir):
+    """Return events having response files but no waveform data
+
+    Parameter
+    =========
+    datadir : str or path-like obj.
+        event directory of waveform, e.g. /data/Level1/CENC
+    respdir : str or path-like obj.
+        event directory of response, e.g. /data/Level1/Response
+    """
+    # hidden entries, e.g. .leases of sharded runs, are not events
+    events = set(os.listdir(datadir))
+    return sorted(name for name in os.listdir(respdir)
+                  if not name.startswith(".") and name not in events)
+
+
+def manifest(datadir, pattern="*.SAC"):
+    """Yield paths of all data files in event directories
+
+    Parameter
+    =========
+    datadir : str or path-like obj.
+        event directory of waveform
+    pattern : str
+        pattern of data files in each event directory
+    """
+    for event in sorted(glob(join(datadir, "*"))):
+        if not isdir(event):
+            continue
+        for filename in sorted(glob(join(event, pattern))):
+            yield filename
+
+
+def read_revisions(revisionfile):
+    """Read station revisions
+
+    Format of station revisions:
+
+        NET  STA  latitude  longitude  elevation  YYYYMMDD  YYYYMMDD
+
+    Parameter
+    =========
+    revisionfile : str or path-like obj.
+        e.g. info/station.revision.txt
+    """
+    revisions = {}
+    with open(revisionfile, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 7:
+                continue
+            net, sta, stla, stlo, stel, starttime, endtime = fields[0:7]
+            if "NAN" in (stla, stlo, stel):
+                continue
+            revisions.setdefault((net, sta), []).append(
+                (starttime, endtime, float(stla), float(stlo), float(stel)))
+    return revisions
+
+
+def check_headers(datadir, revisionfile):
+    """Rewrite station location headers of Level1 data by station revisions
+
+    Parameter
+    =========
+    datadir : str or path-like obj.
+        event directory of waveform
+    revisionfile : str or path-like obj.
+        e.g. info/station.revision.txt
+
+    Return the number of modified files.
+    """
+    from obspy.io.sac import SACTrace
+
+    revisions = read_revisions(revisionfile)
+    modified = 0
+    for filename in manifest(datadir):
+        day = basename(os.path.dirname(filename))[0:8]
+        net, sta = basename(filename).split(".")[6:8]
+
+        location = None
+        for starttime, endtime, stla, stlo, stel in revisions.get((net, sta),
+                                                                  []):
+            if starttime <= day < endtime:
+                location = (stla, stlo, stel)
+        if location is None:
+            continue
+
+        try:
+            sac = SACTrace.read(filename, headonly=True)
+            sac.stla, sac.stlo, sac.stel = location
+            sac.write(filename, headonly=True)
+            modified += 1
+        except Exception as e:
+            logger.error("Can't rewrite header of %s: %s", filename, e)
+    return modified
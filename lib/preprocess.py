@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide batched preprocessing of event waveform
+#       Usage:
+#              Traces of all stations of an event with same length and
+#              sampling rate are stacked into a 2D array, so that detrend,
+#              taper, filter and resample are applied once per group
+#              instead of once per trace. Horizontal components are rotated
+#              to radial and transverse with back azimuths of all stations
+#              computed at once.
+#
+#              Processing is recorded in SAC headers:
+#                  kuser0        filter type (BP, LP or HP)
+#                  user0, user1  corner frequencies of filter
+#                  cmpaz, cmpinc orientation of rotated components
+#------------------------------------------------------------------------------
+import logging
+from fractions import Fraction
+
+import numpy as np
+from scipy import signal
+
+logger = logging.getLogger(__name__)
+
+
+def detrend(data):
+    """Remove linear trend along last axis of 2D array
+    """
+    npts = data.shape[-1]
+    x = np.arange(npts) - (npts - 1) / 2.0
+    mean = data.mean(axis=-1, keepdims=True)
+    denominator = (x ** 2).sum()
+    slope = (data @ x)[:, None] / denominator if denominator else 0.0
+    return data - mean - slope * x
+
+
+def taper(data, max_percentage=0.05):
+    """Apply Hann taper at both ends along last axis of 2D array
+    """
+    npts = data.shape[-1]
+    width = int(npts * max_percentage)
+    if width < 1:
+        return data
+    window = np.ones(npts)
+    ramp = 0.5 * (1.0 - np.cos(np.pi * np.arange(width) / width))
+    window[:width] = ramp
+    window[npts - width:] = ramp[::-1]
+    return data * window
+
+
+def filter_type(freqmin=None, freqmax=None):
+    """Return BP, HP or LP of given corner frequencies
+    """
+    if freqmin and freqmax:
+        return "BP"
+    return "HP" if freqmin else "LP"
+
+
+def butterworth(data, sampling_rate, freqmin=None, freqmax=None, corners=4,
+                zerophase=True):
+    """Apply Butterworth filter along last axis of 2D array
+
+    Bandpass if both freqmin and freqmax are given, else highpass or lowpass.
+    """
+    btype = {"BP": "bandpass", "HP": "highpass", "LP": "lowpass"}[
+        filter_type(freqmin, freqmax)]
+    corner = [f for f in (freqmin, freqmax) if f]
+    if len(corner) == 1:  # highpass or lowpass takes a scalar
+        corner = corner[0]
+    sos = signal.butter(corners, corner, btype=btype, fs=sampling_rate,
+                        output="sos")
+    if zerophase:
+        return signal.sosfiltfilt(sos, data, axis=-1)
+    return signal.sosfilt(sos, data, axis=-1)
+
+
+def resample(data, sampling_rate, target):
+    """Polyphase resampling along last axis of 2D array
+
+    Return resampled data and the exact new sampling rate.
+    """
+    ratio = Fraction(target / sampling_rate).limit_denominator(1000)
+    data = signal.resample_poly(data, ratio.numerator, ratio.denominator,
+                                axis=-1)
+    return data, sampling_rate * ratio.numerator / ratio.denominator
+
+
+def back_azimuth(evla, evlo, stla, stlo):
+    """Vectorized back azimuth in degree on a sphere
+    """
+    evla, evlo, stla, stlo = map(np.radians, (evla, evlo, stla, stlo))
+    dlon = evlo - stlo
+    baz = np.arctan2(np.sin(dlon) * np.cos(evla),
+                     np.cos(stla) * np.sin(evla) -
+                     np.sin(stla) * np.cos(evla) * np.cos(dlon))
+    return np.degrees(baz) % 360.0
+
+
+def rotate_ne_rt(n, e, baz):
+    """Rotate rows of north and east components to radial and transverse
+    """
+    ba = np.radians(baz)[:, None]
+    r = -e * np.sin(ba) - n * np.cos(ba)
+    t = -e * np.cos(ba) + n * np.sin(ba)
+    return r, t
+
+
+def _batches(traces):
+    """Group traces by length and sampling rate
+    """
+    groups = {}
+    for trace in traces:
+        key = (trace.stats.npts, trace.stats.sampling_rate)
+        groups.setdefault(key, []).append(trace)
+    return groups
+
+
+def _set_headers(trace, **headers):
+    """Record SAC headers of processing in trace
+    """
+    trace.stats.preprocess = dict(trace.stats.get("preprocess", {}),
+                                  **headers)
+
+
+def preprocess(streams, event, stations, detrend_data=True, taper_width=0.05,
+               freqmin=None, freqmax=None, corners=4, zerophase=True,
+               sampling_rate=None, rotate=False):
+    """Preprocess streams of all stations of an event in place
+
+    Parameter
+    =========
+    streams : list of `~obspy.Stream`
+        traces of each station
+    event : dict
+        event information, see `mseed2sac.read_catalog`
+    stations : list of dict
+        station of each stream, see `mseed2sac.Client`
+    detrend_data : bool
+        remove mean and linear trend
+    taper_width : float
+        width of Hann taper at each end, no taper if 0
+    freqmin, freqmax : float
+        corner frequencies of Butterworth filter, no filter if both None
+    corners : int
+        order of filter
+    zerophase : bool
+        filter forward and backward
+    sampling_rate : float
+        sampling rate to resample to
+    rotate : bool
+        rotate E and N components to R and T
+    """
+    traces = [trace for stream in streams for trace in stream]
+    for (npts, rate), group in _batches(traces).items():
+        data = np.array([trace.data for trace in group], dtype=np.float64)
+        if detrend_data:
+            data = detrend(data)
+        if taper_width:
+            data = taper(data, taper_width)
+        if freqmin or freqmax:
+            data = butterworth(data, rate, freqmin, freqmax, corners,
+                               zerophase)
+        new_rate = rate
+        if sampling_rate and sampling_rate != rate:
+            data, new_rate = resample(data, rate, sampling_rate)
+
+        for trace, row in zip(group, data):
+            trace.data = row
+            trace.stats.sampling_rate = new_rate
+            if freqmin or freqmax:
+                _set_headers(trace, kuser0=filter_type(freqmin, freqmax),
+                             user0=freqmin or 0.0, user1=freqmax or 0.0)
+        logger.debug("Preprocessed %d traces of %d samples", len(group), npts)
+
+    if rotate:
+        _rotate(streams, event, stations)
+
+
+def _rotate(streams, event, stations):
+    """Rotate horizontal components of all stations, batched by length
+    """
+    pairs = []
+    for stream, station in zip(streams, stations):
+        n = [trace for trace in stream if trace.stats.channel[-1] == "N"]
+        e = [trace for trace in stream if trace.stats.channel[-1] == "E"]
+        if len(n) != 1 or len(e) != 1:
+            continue
+        n, e = n[0], e[0]
+        if n.stats.npts != e.stats.npts or \
+                n.stats.starttime != e.stats.starttime or \
+                n.stats.sampling_rate != e.stats.sampling_rate:
+            logger.warning("Can't rotate %s, different N and E",
+                           station["name"])
+            continue
+        pairs.append((n, e, station))
+    if not pairs:
+        return
+
+    baz = back_azimuth(event["latitude"], event["longitude"],
+                       np.array([station["stla"] for _, _, station in pairs]),
+                       np.array([station["stlo"] for _, _, station in pairs]))
+    groups = {}
+    for index, (n, _, _) in enumerate(pairs):
+        groups.setdefault(n.stats.npts, []).append(index)
+
+    for indices in groups.values():
+        n = np.array([pairs[i][0].data for i in indices], dtype=np.float64)
+        e = np.array([pairs[i][1].data for i in indices], dtype=np.float64)
+        r, t = rotate_ne_rt(n, e, baz[indices])
+        for row, i in enumerate(indices):
+            ntrace, etrace, _ = pairs[i]
+            ntrace.data, etrace.data = r[row], t[row]
+            ntrace.stats.channel = ntrace.stats.channel[:-1] + "R"
+            etrace.stats.channel = etrace.stats.channel[:-1] + "T"
+            _set_headers(ntrace, cmpaz=(baz[i] + 180.0) % 360.0, cmpinc=90.0)
+            _set_headers(etrace, cmpaz=(baz[i] + 270.0) % 360.0, cmpinc=90.0)
@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide quality metrics of event waveform
+#       Usage:
+#              Metrics are computed by mseed2sac.Client while trimming and
+#              written to qc.csv in each event directory:
+#              ├── YYYYMMDDHHMMSS
+#              │   ├── YYYY.JDAY.HH.MM.SS.0000.NET.STA.LOC.CHA.M.SAC
+#              │   └── qc.csv
+#
+#              id, starttime, npts and sampling_rate describe the trace as
+#              written (e.g. BHR after rotation, resampled npts), while the
+#              other metrics are computed on the raw counts before response
+#              removal and preprocessing.
+#
+#              build_index() collects all qc.csv into one SQLite table,
+#              e.g. to find clipped traces
+#
+#                  SELECT event, id FROM qc WHERE clipped > 0
+#------------------------------------------------------------------------------
+import csv
+import sqlite3
+import logging
+from glob import glob
+from os.path import join, basename, dirname, exists
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# largest count of 24-bit digitizers
+CLIP_LEVEL = 2 ** 23 - 1
+
+QC_FILE = "qc.csv"
+QC_FIELDS = ["id", "starttime", "npts", "sampling_rate", "gaps", "overlaps",
+             "fill_fraction", "rms", "max_amplitude", "clipped",
+             "zero_variance"]
+
+
+def gap_counts(stream, starttime=None, endtime=None):
+    """Count gaps and overlaps of each trace id within time window
+
+    Parameter
+    =========
+    stream : `~obspy.Stream`
+        stream before merging
+    starttime, endtime : `~obspy.UTCDateTime`
+        time window, gaps outside are ignored
+
+    Return dict. of trace id to (gaps, overlaps).
+    """
+    counts = {}
+    for net, sta, loc, cha, t1, t2, delta, _ in stream.get_gaps():
+        # t1 > t2 for overlaps
+        begin, end = min(t1, t2), max(t1, t2)
+        if endtime is not None and begin > endtime:
+            continue
+        if starttime is not None and end < starttime:
+            continue
+        trid = ".".join([net, sta, loc, cha])
+        gaps, overlaps = counts.get(trid, (0, 0))
+        if delta < 0:
+            overlaps += 1
+        else:
+            gaps += 1
+        counts[trid] = (gaps, overlaps)
+    return counts
+
+
+def written_metrics(trace):
+    """Return metrics of trace updated with its id and samples as written
+    """
+    return dict(trace.stats.qc, id=trace.id,
+                starttime=str(trace.stats.starttime),
+                npts=trace.stats.npts,
+                sampling_rate=trace.stats.sampling_rate)
+
+
+def trace_metrics(trace, starttime=None, endtime=None, gaps=0, overlaps=0,
+                  clip_level=CLIP_LEVEL):
+    """Compute quality metrics of a trace
+
+    Parameter
+    =========
+    trace : `~obspy.Trace`
+        merged and trimmed trace, gaps are masked
+    starttime, endtime : `~obspy.UTCDateTime`
+        requested time window, missing data at both ends count as filled
+    gaps, overlaps : int
+        counts from `gap_counts`
+    clip_level : float
+        absolute amplitude regarded as clipped
+
+    fill_fraction is the fraction of the window without data, rms is
+    computed after removing the mean and clipped is the number of samples
+    reaching clip_level.
+    """
+    data = trace.data
+    mask = np.ma.getmaskarray(data)
+    valid = np.ma.getdata(data)[~mask]
+
+    expected = trace.stats.npts
+    if starttime is not None and endtime is not None:
+        expected = max(expected, int(round((endtime - starttime) *
+                                           trace.stats.sampling_rate)) + 1)
+
+    metrics = {
+        "id": trace.id,
+        "starttime": str(trace.stats.starttime),
+        "npts": trace.stats.npts,
+        "sampling_rate": trace.stats.sampling_rate,
+        "gaps": gaps,
+        "overlaps": overlaps,
+        "fill_fraction": 1.0 - valid.size / expected if expected else 1.0,
+        "rms": 0.0,
+        "max_amplitude": 0.0,
+        "clipped": 0,
+        "zero_variance": 1,
+    }
+    if valid.size:
+        amplitude = np.abs(valid)
+        metrics.update({
+            "rms": float(np.std(valid)),
+            "max_amplitude": float(amplitude.max()),
+            "clipped": int(np.count_nonzero(amplitude >= clip_level)),
+            "zero_variance": int(valid.min() == valid.max()),
+        })
+    return metrics
+
+
+def read_qc(filename):
+    """Read qc rows of an event
+
+    Parameter
+    =========
+    filename : str or path-like obj.
+        qc.csv of an event
+    """
+    with open(filename, "r", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def write_qc(filename, rows):
+    """Write qc rows of an event, replacing existing rows of same trace id
+
+    Parameter
+    =========
+    filename : str or path-like obj.
+        qc.csv of an event
+    rows : list of dict.
+        metrics from `trace_metrics`
+    """
+    merged = {}
+    if exists(filename):
+        merged.update((row["id"], row) for row in read_qc(filename))
+    merged.update((row["id"], row) for row in rows)
+
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=QC_FIELDS)
+        writer.writeheader()
+        for trid in sorted(merged):
+            writer.writerow(merged[trid])
+
+
+def build_index(sacdir, database=None):
+    """Collect qc.csv of all events into SQLite table qc
+
+    Parameter
+    =========
+    sacdir : str or path-like obj.
+        directory of events
+    database : str or path-like obj.
+        SQLite database, default qc.sqlite in sacdir
+
+    Return the number of indexed traces.
+    """
+    database = database or join(sacdir, "qc.sqlite")
+    columns = ["event"] + QC_FIELDS
+
+    conn = sqlite3.connect(database)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS qc ("
+                         "event TEXT, id TEXT, starttime TEXT, npts INTEGER, "
+                         "sampling_rate REAL, gaps INTEGER, overlaps INTEGER, "
+                         "fill_fraction REAL, rms REAL, max_amplitude REAL, "
+                         "clipped INTEGER, zero_variance INTEGER, "
+                         "PRIMARY KEY (event, id))")
+            count = 0
+            for filename in sorted(glob(join(sacdir, "*", QC_FILE))):
+                event = basename(dirname(filename))
+                rows = [[event] + [row[field] for field in QC_FIELDS]
+                        for row in read_qc(filename)]
+                conn.executemany(
+                    "INSERT OR REPLACE INTO qc ({}) VALUES ({})".format(
+                        ",".join(columns), ",".join("?" * len(columns))),
+                    rows)
+                count += len(rows)
+    finally:
+        conn.close()
+    logger.info("%d traces indexed in %s", count, database)
+    return count
@@ -97,6 +97,26 @@ class SourceResponse(object):
             network_responses.append(value.loop_for_event(time))
         return network_responses
 
+    def get_response_file(self, trid, time):
+        """Return location of response file of a channel at particular time
+
+        Parameter
+        =========
+        trid : str
+            trace id, NET.STA.LOC.CHA
+        time : `~ObsPy.UTCDateTime`
+            time to extract the response file
+        """
+        net, sta, _, cha = trid.split(".")
+        if net not in self.response:
+            return None
+        # location code of response files is always 00
+        trace_response = self.response[net].responses.get(
+            ".".join([net, sta, "00", cha]))
+        if trace_response is None or not trace_response.periods:
+            return None
+        return trace_response.get_response(time)
+
 class NetworkResponse(object):
     """class to handle response file of an entire network
     """
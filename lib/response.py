@@ -0,0 +1,229 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide instrument response removal of event waveform
+#       Usage:
+#              SACPZ files are found by respider.SourceResponse and parsed
+#              once (a few KB each). The inverse spectrum of each (SACPZ
+#              file, npts, sampling rate) is kept in a LRU cache bounded by
+#              RESPONSE_CACHE_BYTES, so that traces of the same channel and
+#              window length share it.
+#
+#              A spectrum takes 16 * (nfft / 2 + 1) bytes, nfft being about
+#              2 * npts, e.g. 9.6 MB for 6000 s at 100 Hz. As each channel
+#              has its own SACPZ file, spectra are only reused across events
+#              if all channels fit in the cache, e.g. a few stations or the
+#              cut service; otherwise the cache just bounds the memory.
+#
+#              As SAC `transfer`, output is in nm, nm/s or nm/s/s.
+#------------------------------------------------------------------------------
+import codecs
+import logging
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+import numpy as np
+from scipy.fft import next_fast_len
+
+from lib.preprocess import detrend, taper
+
+logger = logging.getLogger(__name__)
+
+# maximum bytes of inverse spectra kept in memory
+RESPONSE_CACHE_BYTES = 512 * 1024 ** 2
+
+# SACPZ are in meters, output in nanometers as SAC `transfer`
+NM_PER_M = 1e9
+
+# SAC idep header of each output
+IDEP = {"DISP": "idisp", "VEL": "ivel", "ACC": "iacc"}
+
+
+@lru_cache(maxsize=None)
+def read_sacpz(filename):
+    """Read poles, zeros and constant of SACPZ file
+
+    Parameter
+    =========
+    filename : str or path-like obj.
+        SACPZ file, comments start with "*"
+
+    Return (zeros, poles, constant), zeros at origin not listed in file
+    are included.
+    """
+    zeros, poles, constant = [], [], 1.0
+    current, count = None, 0
+    with codecs.open(filename, "r", "gbk", errors="replace") as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("*"):
+                continue
+            key = fields[0].upper()
+            if key in ("ZEROS", "POLES"):
+                if current is not None:
+                    current.extend([0j] * (count - len(current)))
+                current = zeros if key == "ZEROS" else poles
+                count = int(fields[1])
+            elif key == "CONSTANT":
+                constant = float(fields[1])
+            elif current is not None and len(fields) >= 2:
+                current.append(complex(float(fields[0]), float(fields[1])))
+    if current is not None:
+        current.extend([0j] * (count - len(current)))
+    return np.array(zeros), np.array(poles), constant
+
+
+class SpectrumCache(object):
+    """LRU cache of arrays bounded by their total bytes, thread safe
+    """
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if value.nbytes > self.maxbytes:
+            return
+        with self.lock:
+            if key in self.items:
+                return
+            self.items[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.maxbytes:
+                _, oldest = self.items.popitem(last=False)
+                self.nbytes -= oldest.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+
+
+_spectra = SpectrumCache(RESPONSE_CACHE_BYTES)
+
+
+def inverse_spectrum(pzfile, npts, sampling_rate, output="VEL",
+                     water_level=60.0, pre_filt=None):
+    """Return inverse of instrument response on rfft frequencies, cached
+
+    Parameter
+    =========
+    pzfile : str or path-like obj.
+        SACPZ file in displacement
+    npts : int
+        number of samples of trace
+    sampling_rate : float
+        sampling rate of trace
+    output : str
+        DISP, VEL or ACC
+    water_level : float
+        water level in dB below maximum of response
+    pre_filt : tuple
+        corners (f1, f2, f3, f4) of cosine taper in frequency domain
+    """
+    key = (pzfile, npts, sampling_rate, output, water_level, pre_filt)
+    inverse = _spectra.get(key)
+    if inverse is None:
+        inverse = _inverse_spectrum(*key)
+        _spectra.put(key, inverse)
+    return inverse
+
+
+def _inverse_spectrum(pzfile, npts, sampling_rate, output, water_level,
+                      pre_filt):
+    zeros, poles, constant = read_sacpz(pzfile)
+    nfft = next_fast_len(2 * npts)
+    freqs = np.fft.rfftfreq(nfft, d=1.0 / sampling_rate)
+    s = 2j * np.pi * freqs
+
+    # remove one zero at origin per derivative
+    power = {"DISP": 0, "VEL": 1, "ACC": 2}[output]
+    response = constant * np.ones_like(s)
+    for zero in zeros:
+        response *= s - zero
+    for pole in poles:
+        response /= s - pole
+    response[1:] /= s[1:] ** power
+
+    # water level keeps phase
+    amplitude = np.abs(response)
+    level = amplitude.max() * 10.0 ** (-water_level / 20.0)
+    low = amplitude < level
+    response[low] = level * np.exp(1j * np.angle(response[low]))
+
+    inverse = NM_PER_M / response
+    inverse[0] = 0.0
+    if pre_filt is not None:
+        inverse *= cosine_taper(freqs, pre_filt)
+    inverse.setflags(write=False)
+    return inverse
+
+
+def cosine_taper(freqs, corners):
+    """Cosine taper being 1 between f2 and f3 and 0 outside f1 and f4
+    """
+    f1, f2, f3, f4 = corners
+    taper = np.zeros(len(freqs))
+    taper[(freqs >= f2) & (freqs <= f3)] = 1.0
+    left = (freqs > f1) & (freqs < f2)
+    taper[left] = 0.5 * (1.0 - np.cos(np.pi * (freqs[left] - f1) / (f2 - f1)))
+    right = (freqs > f3) & (freqs < f4)
+    taper[right] = 0.5 * (1.0 + np.cos(np.pi * (freqs[right] - f3) /
+                                       (f4 - f3)))
+    return taper
+
+
+def remove_response(stream, pzfiles, output="VEL", water_level=60.0,
+                    pre_filt=None):
+    """Remove instrument response of traces in stream
+
+    Traces of same length and sampling rate are deconvolved together in one
+    batched FFT. Traces without response file are removed from stream.
+
+    Parameter
+    =========
+    stream : `~obspy.Stream`
+        traces in counts
+    pzfiles : dict
+        trace id to SACPZ file
+    output : str
+        DISP, VEL or ACC
+    water_level : float
+        water level in dB
+    pre_filt : tuple
+        corners (f1, f2, f3, f4) of cosine taper in frequency domain
+    """
+    groups = {}
+    for trace in list(stream):
+        if not pzfiles.get(trace.id):
+            logger.warning("No response file for %s", trace.id)
+            stream.remove(trace)
+            continue
+        key = (trace.stats.npts, trace.stats.sampling_rate)
+        groups.setdefault(key, []).append(trace)
+
+    for (npts, sampling_rate), traces in groups.items():
+        data = np.array([trace.data for trace in traces], dtype=np.float64)
+        data = taper(detrend(data))
+
+        nfft = next_fast_len(2 * npts)
+        inverse = np.array([
+            inverse_spectrum(pzfiles[trace.id], npts, sampling_rate, output,
+                             water_level, pre_filt)
+            for trace in traces])
+        data = np.fft.irfft(np.fft.rfft(data, n=nfft, axis=-1) * inverse,
+                            n=nfft, axis=-1)[:, :npts]
+
+        for trace, row in zip(traces, data):
+            trace.data = row
+            trace.stats.output = output
+    return stream
@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide local on-demand waveform cut service
+#       Usage:
+#              python cgrm.py serve --mseeddir /data/mseed
+#
+#              GET /cut?event=20160103230522&stations=AH.ANQ,XJ.AKS
+#              GET /cut?time=2016-01-03T23:05:22&duration=3600&format=sac
+#                  &stations=AH.ANQ&channel=BHZ
+#
+#              Parameters:
+#                event          event id (YYYYMMDDHHMMSS) in catalog
+#                time           origin time, the nearest event in catalog
+#                stations       NET.STA separated by comma, default all
+#                start_offset   offset of starttime in second (default 0)
+#                duration       window length in second (default 6000)
+#                format         tar (default) or sac for a single trace
+#                channel        channel of trace for format sac, e.g. BHZ
+#
+#              Results are bundled as tar and cached on disk, least
+#              recently used bundles are removed beyond the size limit.
+#------------------------------------------------------------------------------
+import os
+import io
+import json
+import shutil
+import hashlib
+import tarfile
+import logging
+import tempfile
+import threading
+from glob import glob
+from os.path import join, getsize, basename
+from urllib.parse import urlparse, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from lib.catalog import Catalog, to_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceError(Exception):
+    """error with HTTP status to send back
+    """
+
+    def __init__(self, status, message):
+        super(ServiceError, self).__init__(message)
+        self.status = status
+
+
+class CutService(object):
+    """class to trim waveform on demand with a result cache
+    """
+
+    def __init__(self, client, catalog, cachedir, cache_size=2 * 1024 ** 3,
+                 max_jobs=2, queue_timeout=60, time_tolerance=60):
+        """initialization
+
+        Parameter
+        =========
+        client : `~mseed2sac.Client`
+            client to trim waveform
+        catalog : str or path-like obj.
+            event catalog, e.g. catalog_released.csv
+        cachedir : str or path-like obj.
+            directory of cached results
+        cache_size : int
+            maximum size of cached results in bytes
+        max_jobs : int
+            maximum number of concurrent trimming jobs
+        queue_timeout : float
+            seconds to wait for a free job before rejecting a request
+        time_tolerance : float
+            maximum difference in seconds between time and matched event
+        """
+        self.client = client
+        self.catalog = catalog
+        self.cachedir = cachedir
+        self.cache_size = cache_size
+        self.queue_timeout = queue_timeout
+        self.time_tolerance = time_tolerance
+        self.jobs = threading.BoundedSemaphore(max_jobs)
+        self.lock = threading.Lock()
+        self.pending = {}
+        os.makedirs(cachedir, exist_ok=True)
+
+    def __repr__(self):
+        """representation
+        """
+        return "<Cut service of {}>".format(self.client.mseeddir)
+
+    def find_event(self, query):
+        """Return event dict. requested by event id or origin time
+        """
+        catalog = Catalog(self.catalog)
+        if "event" in query:
+            event = catalog.get(query["event"])
+        elif "time" in query:
+            try:
+                time = to_timestamp(query["time"])
+            except ValueError:
+                raise ServiceError(400, "Can't resolve time")
+            near = catalog.select(starttime=time - self.time_tolerance,
+                                  endtime=time + self.time_tolerance)
+            event = None
+            if len(near):
+                nearest = abs(near.events["time"] - time).argmin()
+                event = next(iter(near[int(nearest)]))
+        else:
+            raise ServiceError(400, "event or time is required")
+        if event is None:
+            raise ServiceError(404, "No such event in catalog")
+        return event
+
+    def parse(self, query):
+        """Return event, stations, window and format of request
+        """
+        event = self.find_event(query)
+        stations = None
+        if query.get("stations"):
+            stations = sorted(set(query["stations"].split(",")))
+        try:
+            by_event = {"start_offset": float(query.get("start_offset", 0)),
+                        "duration": float(query.get("duration", 6000))}
+        except ValueError:
+            raise ServiceError(400, "Can't resolve window")
+        if by_event["duration"] <= 0:
+            raise ServiceError(400, "duration should be positive")
+        fmt = query.get("format", "tar")
+        if fmt not in ("tar", "sac"):
+            raise ServiceError(400, "format should be tar or sac")
+        return event, stations, by_event, fmt
+
+    def request(self, query):
+        """Return opened bundle of request, trim waveform if not cached
+
+        The bundle is returned opened, so that it can still be sent if it
+        is evicted by another request meanwhile.
+
+        Parameter
+        =========
+        query : dict
+            request parameters, see module docstring
+        """
+        event, stations, by_event, fmt = self.parse(query)
+        key = hashlib.sha1(json.dumps([
+            event["origin"].strftime("%Y%m%d%H%M%S"), stations, by_event,
+            self.settings()], sort_keys=True).encode()).hexdigest()
+        bundle = join(self.cachedir, key + ".tar")
+
+        # requests of same key wait for the first one
+        with self.lock:
+            keylock = self.pending.setdefault(key, threading.Lock())
+        try:
+            with keylock:
+                try:
+                    fileobj = open(bundle, "rb")
+                    os.utime(fileobj.fileno())  # mark as recently used
+                    logger.info("Cache hit %s", key)
+                except FileNotFoundError:
+                    fileobj = self._cut(event, stations, by_event, bundle)
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+        return fileobj, fmt
+
+    def settings(self):
+        """Processing settings of client, results differ between them
+        """
+        return {"output": self.client.output,
+                "water_level": self.client.water_level,
+                "pre_filt": self.client.pre_filt,
+                "qc": self.client.qc}
+
+    def _cut(self, event, stations, by_event, bundle):
+        """Trim waveform into a tar bundle, return it opened
+        """
+        if not self.jobs.acquire(timeout=self.queue_timeout):
+            raise ServiceError(503, "Too many requests, try later")
+        workdir = tempfile.mkdtemp(dir=self.cachedir)
+        try:
+            self.client.get_waveform(event, by_event=by_event,
+                                     stations=stations, sacdir=workdir)
+            eventdir = event["origin"].strftime("%Y%m%d%H%M%S")
+            if not glob(join(workdir, eventdir, "*.SAC")):
+                raise ServiceError(404, "No data of requested stations")
+            tmpfile = join(workdir, "bundle.tar")
+            with tarfile.open(tmpfile, "w") as tar:
+                tar.add(join(workdir, eventdir), arcname=eventdir)
+            # opened before eviction by other requests can remove it
+            with self.lock:
+                os.replace(tmpfile, bundle)
+                fileobj = open(bundle, "rb")
+                self._evict(keep=bundle)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            self.jobs.release()
+        return fileobj
+
+    def _evict(self, keep=None):
+        """Remove least recently used bundles beyond cache size
+        """
+        bundles = sorted((name for name in glob(join(self.cachedir, "*.tar"))
+                          if name != keep),
+                         key=lambda name: os.stat(name).st_mtime)
+        if keep is not None:
+            bundles.append(keep)
+        total = sum(getsize(name) for name in bundles)
+        while len(bundles) > 1 and total > self.cache_size:
+            name = bundles.pop(0)
+            total -= getsize(name)
+            os.remove(name)
+            logger.info("Evict %s", basename(name))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(service):
+    """Return request handler class bound to service
+    """
+
+    class CutHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/cut":
+                self.send_error(404, "Only /cut is provided")
+                return
+            query = {key: values[-1]
+                     for key, values in parse_qs(url.query).items()}
+            try:
+                bundle, fmt = service.request(query)
+                with bundle:
+                    if fmt == "sac":
+                        self._send_sac(bundle, query.get("channel"))
+                    else:
+                        self._send_file(bundle, "application/x-tar",
+                                        basename(bundle.name))
+            except ServiceError as e:
+                self.send_error(e.status, str(e))
+            except Exception as e:
+                logger.error("Error in %s: %s", self.path, e)
+                self.send_error(500, "Error in trimming")
+
+        def _send_sac(self, bundle, channel=None):
+            suffix = ".{}.M.SAC".format(channel) if channel else ".SAC"
+            with tarfile.open(fileobj=bundle, mode="r") as tar:
+                members = [member for member in tar.getmembers()
+                           if member.name.endswith(suffix)]
+                if len(members) != 1:
+                    raise ServiceError(400, "{} traces, format sac needs "
+                                       "exactly one".format(len(members)))
+                data = tar.extractfile(members[0]).read()
+            self._send_file(io.BytesIO(data), "application/octet-stream",
+                            basename(members[0].name), len(data))
+
+        def _send_file(self, fileobj, content_type, filename, length=None):
+            if length is None:
+                length = os.fstat(fileobj.fileno()).st_size
+            with fileobj:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(length))
+                self.send_header("Content-Disposition",
+                                 "attachment; filename={}".format(filename))
+                self.end_headers()
+                shutil.copyfileobj(fileobj, self.wfile)
+
+        def log_message(self, format, *args):
+            logger.info("%s %s", self.address_string(), format % args)
+
+    return CutHandler
+
+
+def serve(service, host="127.0.0.1", port=8000):
+    """Serve cut requests until interrupted
+
+    Parameter
+    =========
+    service : `CutService`
+        service to handle requests
+    host : str
+        address to bind, localhost by default
+    port : int
+        port to bind
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    logger.info("Serving on http://%s:%d/cut", host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,339 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide sharded execution of catalog tasks over hosts
+#       Usage:
+#              python cgrm.py cut --shard 0/4 ...   # on host 1
+#              python cgrm.py cut --shard 1/4 ...   # on host 2, ...
+#              python cgrm.py merge --leasedir SAC/.leases ...
+#
+#              Events are assigned to shards by a stable hash of the task
+#              key, the event id or the day (in BJT, same as the archive)
+#              of the event. Each task holds a lease file on the shared
+#              output filesystem while running and leaves a done marker:
+#              ├── .leases
+#              │   ├── settings.json options of the run, e.g. window
+#              │   ├── <task>.lock   owner, renewed while running
+#              │   └── <task>.done   task finished
+#              Done markers only hold for the settings of the run, so a
+#              run with other settings is refused until another lease
+#              directory is given or the old one removed.
+#              Leases not renewed within ttl are regarded as stale. Tasks of
+#              a crashed host are only run by rerunning its shard, which
+#              takes over stale leases and skips tasks done.
+#------------------------------------------------------------------------------
+import os
+import json
+import time
+import zlib
+import socket
+import logging
+import threading
+from uuid import uuid4
+from os.path import join, exists
+from contextlib import contextmanager
+
+import numpy as np
+
+from lib.catalog import BJT_OFFSET
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(string):
+    """Parse shard "i/N" into (i, N), 0 <= i < N
+    """
+    try:
+        index, count = [int(item) for item in string.split("/")]
+    except ValueError:
+        raise ValueError("shard should be i/N, got {}".format(string))
+    if not 0 <= index < count:
+        raise ValueError("shard index should be in [0, {})".format(count))
+    return index, count
+
+
+def task_keys(catalog, by="event"):
+    """Return task key of each event
+
+    Parameter
+    =========
+    catalog : `~lib.catalog.Catalog`
+        events
+    by : str
+        event for event id, day for day of origin time in BJT (YYYYMMDD)
+    """
+    if by == "event":
+        return catalog.ids
+    seconds = np.floor(catalog.events["time"]).astype("int64") + BJT_OFFSET
+    days = np.datetime_as_string(seconds.astype("datetime64[s]"), unit="D")
+    return np.char.replace(days, "-", "")
+
+
+def shard_of(key, count):
+    """Return index of shard of task key among count shards
+    """
+    return zlib.crc32(str(key).encode()) % count
+
+
+def shard_tasks(catalog, by="event", shard=None):
+    """Return task key to events of this shard, in catalog order
+
+    Parameter
+    =========
+    catalog : `~lib.catalog.Catalog`
+        events
+    by : str
+        event or day, see `task_keys`
+    shard : tuple
+        (i, N) from `parse_shard`, all tasks if None
+    """
+    groups = {}
+    for index, key in enumerate(task_keys(catalog, by)):
+        groups.setdefault(str(key), []).append(index)
+    if shard is not None:
+        groups = {key: indices for key, indices in groups.items()
+                  if shard_of(key, shard[1]) == shard[0]}
+    return {key: catalog[np.array(indices)]
+            for key, indices in groups.items()}
+
+
+class Lease(object):
+    """class to handle lease file of a task on shared filesystem
+    """
+
+    def __init__(self, leasedir, task, ttl=3600):
+        """initialization
+
+        Parameter
+        =========
+        leasedir : str or path-like obj.
+            directory of lease files, shared by all hosts
+        task : str
+            task key
+        ttl : float
+            seconds after which a lease not renewed is stale, should be
+            much longer than clock differences between hosts
+        """
+        self.leasedir = leasedir
+        self.task = task
+        self.ttl = ttl
+        self.lockfile = join(leasedir, task + ".lock")
+        self.donefile = join(leasedir, task + ".done")
+        self.owner = "{}:{}".format(socket.gethostname(), os.getpid())
+        os.makedirs(leasedir, exist_ok=True)
+
+    def __repr__(self):
+        """representation
+        """
+        return "<Lease of {} by {}>".format(self.task, self.owner)
+
+    def done(self):
+        return exists(self.donefile)
+
+    def stale(self, filename=None):
+        """Whether the lease file has not been renewed within ttl
+        """
+        try:
+            mtime = os.stat(filename or self.lockfile).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - mtime > self.ttl
+
+    def _create(self):
+        try:
+            fd = os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({"owner": self.owner, "time": time.time()}, f)
+        return True
+
+    def owner_of(self, filename=None):
+        """Return owner recorded in the lease file, None if unreadable
+        """
+        try:
+            with open(filename or self.lockfile, "r") as f:
+                return json.load(f).get("owner")
+        except (OSError, ValueError):
+            return None
+
+    def owned(self):
+        return self.owner_of() == self.owner
+
+    def break_stale(self):
+        """Remove the lease file if stale, whoever holds it
+        """
+        grave = "{}.{}".format(self.lockfile, uuid4().hex)
+        try:
+            os.rename(self.lockfile, grave)
+        except FileNotFoundError:
+            return
+        # another host may have taken over the lease meanwhile, give it back
+        if not self.stale(grave):
+            try:
+                os.link(grave, self.lockfile)
+            except FileExistsError:
+                pass
+        else:
+            logger.warning("Break stale lease of %s", self.task)
+        os.remove(grave)
+
+    def acquire(self):
+        """Take the lease, return False if done or held by another host
+        """
+        if self.done():
+            return False
+        if not self._create():
+            if not self.stale():
+                return False
+            self.break_stale()
+            if not self._create():
+                return False
+        # finished by another host between checking and taking the lease
+        if self.done():
+            self.release()
+            return False
+        return True
+
+    def renew(self):
+        """Renew the lease, return False if it was taken by another host
+        """
+        if not self.owned():
+            return False
+        os.utime(self.lockfile)
+        return True
+
+    def release(self):
+        """Give up the lease without marking the task done
+        """
+        if not self.owned():
+            return
+        try:
+            os.remove(self.lockfile)
+        except FileNotFoundError:
+            pass
+
+    def complete(self):
+        """Mark the task done and give up the lease
+        """
+        if not self.owned():
+            logger.warning("Lease of %s was taken over, task may be run "
+                           "twice", self.task)
+        with open(self.donefile, "w") as f:
+            json.dump({"owner": self.owner, "time": time.time()}, f)
+        self.release()
+
+    @contextmanager
+    def heartbeat(self):
+        """Renew the lease periodically while running the task
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.ttl / 4.0):
+                try:
+                    if not self.renew():
+                        logger.error("Lost lease of %s", self.task)
+                        return
+                except OSError as e:
+                    logger.error("Can't renew lease of %s: %s", self.task, e)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+
+SETTINGS_FILE = "settings.json"
+
+
+def check_settings(leasedir, settings):
+    """Record settings of the run in leasedir, or compare with recorded
+
+    Raise ValueError if the lease directory was used with other settings.
+
+    Parameter
+    =========
+    leasedir : str or path-like obj.
+        directory of lease files
+    settings : dict
+        options determining the output, JSON serializable
+    """
+    os.makedirs(leasedir, exist_ok=True)
+    filename = join(leasedir, SETTINGS_FILE)
+    settings = json.loads(json.dumps(settings))  # tuples as lists
+    tmpfile = "{}.{}".format(filename, uuid4().hex)
+    with open(tmpfile, "w") as f:
+        json.dump(settings, f, indent=1, sort_keys=True)
+    try:
+        os.link(tmpfile, filename)  # atomic, fails if recorded
+    except FileExistsError:
+        with open(filename, "r") as f:
+            recorded = json.load(f)
+        if recorded != settings:
+            changed = sorted(key for key in set(recorded) | set(settings)
+                             if recorded.get(key) != settings.get(key))
+            raise ValueError("{} was used with other settings ({}), give "
+                             "another leasedir or remove it".format(
+                                 leasedir, ", ".join(changed)))
+    finally:
+        os.remove(tmpfile)
+
+
+def run_tasks(tasks, leasedir, func, ttl=3600):
+    """Run tasks not done and not held by other hosts
+
+    Parameter
+    =========
+    tasks : dict
+        task key to events, from `shard_tasks`
+    leasedir : str or path-like obj.
+        directory of lease files
+    func : callable
+        called with events of each task
+    ttl : float
+        seconds after which a lease not renewed is stale
+
+    Return the number of tasks done by this host.
+    """
+    count = 0
+    for key, events in tasks.items():
+        lease = Lease(leasedir, key, ttl)
+        if not lease.acquire():
+            continue
+        try:
+            with lease.heartbeat():
+                func(events)
+        except Exception as e:
+            logger.error("Task %s failed: %s", key, e)
+            lease.release()
+            continue
+        lease.complete()
+        count += 1
+    return count
+
+
+def check_completeness(keys, leasedir, ttl=3600):
+    """Return tasks grouped by status: done, running, stale and missing
+
+    Parameter
+    =========
+    keys : list of str
+        task keys of all shards
+    leasedir : str or path-like obj.
+        directory of lease files
+    ttl : float
+        seconds after which a lease not renewed is stale
+    """
+    status = {"done": [], "running": [], "stale": [], "missing": []}
+    for key in sorted(set(keys)):
+        lease = Lease(leasedir, key, ttl)
+        if lease.done():
+            status["done"].append(key)
+        elif exists(lease.lockfile):
+            status["stale" if lease.stale() else "running"].append(key)
+        else:
+            status["missing"].append(key)
+    return status
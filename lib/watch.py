@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+#------------------------------------------------------------------------------
+#     Purpose: Provide incremental cutting and publishing of new events
+#       Usage:
+#              Watcher polls the event catalog and the day directories of
+#              the miniSEED archive. Only events new to the catalog and
+#              events whose days received new stations are trimmed by
+#              mseed2sac.Client, and newly published events are appended
+#              to database.csv.
+#
+#              What has been done is kept in a JSON state file:
+#              {
+#                  "events": {"YYYYMMDDHHMMSS": {"published": true}},
+#                  "days": {"YYYYMMDD": {"mtime": 0.0,
+#                                        "stations": ["NET.STA"]}}
+#              }
+#------------------------------------------------------------------------------
+import os
+import json
+import time
+import logging
+from os.path import join, exists, isdir
+
+import numpy as np
+from obspy import UTCDateTime
+
+from lib.catalog import Catalog, BJT_OFFSET
+from catalog2database import database_entries, HEADER
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher(object):
+    """class to cut and publish events incrementally
+    """
+
+    def __init__(self, client, catalog, statefile, by_event, selection=None,
+                 epicenter=None, sourceresponse=None, respdir="./event",
+                 database="./database.csv", dirroot="CENC"):
+        """initialization
+
+        Parameter
+        =========
+        client : `~mseed2sac.Client`
+            client to trim waveform
+        catalog : str or path-like obj.
+            event catalog, e.g. catalog_released.csv
+        statefile : str or path-like obj.
+            JSON file to keep state between polls
+        by_event : dict
+            window of waveform, see `mseed2sac.Client.get_waveform`
+        selection : dict
+            keyword arguments of `lib.catalog.Catalog.select`
+        epicenter : dict
+            range of epicentral distance, see `mseed2sac.Client.get_waveform`
+        sourceresponse : `~lib.respider.SourceResponse`
+            response files, responses of events are not collected if None
+        respdir : str or path-like obj.
+            output directory of response files of events
+        database : str or path-like obj.
+            database.csv to append published events to
+        dirroot : str
+            dir column prefix of database.csv
+        """
+        self.client = client
+        self.catalog = catalog
+        self.statefile = statefile
+        self.by_event = by_event
+        self.selection = selection or {}
+        self.epicenter = epicenter
+        self.sourceresponse = sourceresponse
+        self.respdir = respdir
+        self.database = database
+        self.dirroot = dirroot
+        self.state = self._read_state()
+
+    def __repr__(self):
+        """representation
+        """
+        return "<Watcher of {}>".format(self.catalog)
+
+    def _read_state(self):
+        if not exists(self.statefile):
+            return {"events": {}, "days": {}}
+        with open(self.statefile, "r") as f:
+            return json.load(f)
+
+    def _write_state(self):
+        tmpfile = self.statefile + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmpfile, self.statefile)
+
+    def _load_catalog(self):
+        return Catalog(self.catalog).select(**self.selection)
+
+    def _scan_days(self):
+        """Return day directories changed since last poll
+
+        Return dict. of day to (mtime, stations, new stations).
+        """
+        changes = {}
+        for day in sorted(os.listdir(self.client.mseeddir)):
+            path = join(self.client.mseeddir, day)
+            if len(day) != 8 or not day.isdigit() or not isdir(path):
+                continue
+            mtime = os.stat(path).st_mtime
+            known = self.state["days"].get(day, {"mtime": None,
+                                                 "stations": []})
+            if known["mtime"] == mtime:
+                continue
+            stations = {".".join(name.split(".")[0:2])
+                        for name in os.listdir(path)
+                        if name.endswith(".mseed")}
+            new = stations - set(known["stations"])
+            changes[day] = (mtime, sorted(stations), new)
+        return changes
+
+    def _events_of_day(self, catalog, day):
+        """Return ids of events whose window overlaps day (in BJT)
+        """
+        start = UTCDateTime(day).timestamp - BJT_OFFSET
+        end = start + 86400
+        offset = self.by_event["start_offset"]
+        duration = self.by_event["duration"]
+        return catalog.select(starttime=start - offset - duration,
+                              endtime=end - offset).ids
+
+    def _has_data(self, event_id):
+        outdir = join(self.client.sacdir, event_id)
+        return isdir(outdir) and any(name.endswith(".SAC")
+                                     for name in os.listdir(outdir))
+
+    def _append_database(self, catalog):
+        """Append entries of events to database.csv
+        """
+        header = not exists(self.database)
+        with open(self.database, "a") as f:
+            if header:
+                print(HEADER, file=f)
+            for _, entry, _ in database_entries(catalog, self.dirroot):
+                print(entry, file=f)
+
+    def initialize(self):
+        """Regard current catalog and archive as processed
+        """
+        for event_id in self._load_catalog().ids:
+            self.state["events"][event_id] = {"published": True}
+        for day, (mtime, stations, _) in self._scan_days().items():
+            self.state["days"][day] = {"mtime": mtime, "stations": stations}
+        self._write_state()
+
+    def poll(self):
+        """Cut and publish new events and new station-days once
+
+        Each event is published and saved in state file as soon as it is
+        done, so that an error of one event neither stops others nor marks
+        it done. Failed events and their days are retried in next poll.
+
+        Return the number of trimmed events.
+        """
+        catalog = self._load_catalog()
+        ids = catalog.ids
+
+        # event id to stations to trim, None for all stations
+        tasks = {event_id: None for event_id in ids
+                 if event_id not in self.state["events"]}
+
+        changes = self._scan_days()
+        day_events = {}
+        for day, (_, _, new) in changes.items():
+            if not new:
+                continue
+            day_events[day] = self._events_of_day(catalog, day)
+            for event_id in day_events[day]:
+                if event_id in tasks and tasks[event_id] is None:
+                    continue
+                tasks.setdefault(event_id, set()).update(new)
+
+        index = {event_id: i for i, event_id in enumerate(ids)}
+        failed = set()
+        for event_id in sorted(tasks):
+            try:
+                self._process(catalog, index[event_id], tasks[event_id])
+            except Exception as e:
+                logger.error("Error in processing %s: %s", event_id, e)
+                failed.add(event_id)
+
+        # state of days is only updated after their events are trimmed
+        for day, (mtime, stations, _) in changes.items():
+            if failed.intersection(day_events.get(day, [])):
+                continue
+            self.state["days"][day] = {"mtime": mtime, "stations": stations}
+        self._write_state()
+        return len(tasks) - len(failed)
+
+    def _process(self, catalog, index, stations):
+        """Cut an event, and publish it if it has data for the first time
+        """
+        event = next(iter(catalog[index]))
+        event_id = event["origin"].strftime("%Y%m%d%H%M%S")
+        logger.info("Cut %s (%s stations)", event_id,
+                    "all" if stations is None else len(stations))
+        self.client.get_waveform(event, by_event=self.by_event,
+                                 epicenter=self.epicenter, stations=stations)
+
+        record = self.state["events"].get(event_id, {"published": False})
+        if not record["published"] and self._has_data(event_id):
+            if self.sourceresponse is not None:
+                from event_response_spider import event_assign
+                event_assign(event["origin"], self.sourceresponse,
+                             export_dir=self.respdir)
+            self._append_database(catalog[np.array([index])])
+            logger.info("Published %s", event_id)
+            record = {"published": True}
+        self.state["events"][event_id] = record
+        self._write_state()
+
+    def run(self, interval=60):
+        """Poll forever
+
+        Parameter
+        =========
+        interval : float
+            seconds between polls
+        """
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error("Error in polling: %s", e)
+            time.sleep(interval)
@@ -57,18 +57,23 @@ For example:
 """
 import os
 import logging
-from datetime import timedelta
 
+import numpy as np
 from obspy import read, UTCDateTime, Stream
 from obspy.io.sac import SACTrace
 from obspy.taup import TauPyModel
 from obspy.geodetics import locations2degrees
-from tqdm import tqdm
+
+from lib.catalog import Catalog, BJT_OFFSET
+from lib.qc import (gap_counts, trace_metrics, written_metrics, write_qc,
+                    QC_FILE)
+from lib.response import remove_response, IDEP
+from lib.preprocess import preprocess as preprocess_streams
 
 # Setup the logger
 FORMAT = "[%(asctime)s]  %(levelname)s: %(message)s"
 logging.basicConfig(
-    filename="logger.info"
+    filename="logger.info",
     level=logging.DEBUG,
     format=FORMAT,
     datefmt='%Y-%m-%d %H:%M:%S'
@@ -77,9 +82,40 @@ logger = logging.getLogger(__name__)
 
 
 class Client(object):
-    def __init__(self, stationinfo, mseeddir, sacdir, model='prem'):
+    def __init__(self, stationinfo, mseeddir, sacdir, model='prem',
+                 qc=False, response=None, output=None, water_level=60.0,
+                 pre_filt=None):
+        """
+        Parameters
+        ----------
+        stationinfo: str
+            Station metadata file
+        mseeddir: str
+            Directory of continuous miniSEED
+        sacdir: str
+            Directory of output SAC
+        model: str
+            TauP model to determine phase windows
+        qc: bool
+            Write quality metrics of traces to qc.csv of each event
+        response: lib.respider.SourceResponse
+            Response files, required if output is given
+        output: str
+            Remove instrument response to DISP, VEL or ACC
+        water_level: float
+            Water level in dB of response removal
+        pre_filt: tuple
+            Corners (f1, f2, f3, f4) of frequency taper in response removal
+        """
         self.mseeddir = mseeddir
         self.sacdir = sacdir
+        self.qc = qc
+        if output and response is None:
+            raise ValueError("response is required to remove response")
+        self.response = response
+        self.output = output
+        self.water_level = water_level
+        self.pre_filt = tuple(pre_filt) if pre_filt else None
         self.stations = self._read_stations(stationinfo)
         self.model = TauPyModel(model=model)
 
@@ -135,8 +171,8 @@ class Client(object):
         Get directory names based on starttime and endtime.
         """
         # mseed data are stored according to BJT not UTC
-        starttime_in_bjt = starttime + timedelta(hours=8)
-        endtime_in_bjt = endtime + timedelta(hours=8)
+        starttime_in_bjt = starttime + BJT_OFFSET
+        endtime_in_bjt = endtime + BJT_OFFSET
 
         if starttime_in_bjt.date == endtime_in_bjt.date:  # one day
             return [starttime_in_bjt.strftime("%Y%m%d")]
@@ -166,9 +202,13 @@ class Client(object):
             except Exception as e:
                 logger.error("Error in reading: %s", e)
 
-        # Merge data
+        # gaps and overlaps are only visible before merging
+        if self.qc:
+            gaps = gap_counts(st, starttime, endtime)
+
+        # Merge data, gaps are masked until quality metrics are computed
         try:
-            st.merge(fill_value=0)
+            st.merge()
         except Exception:
             logger.error("Error in merging %s", station['name'])
             return None
@@ -179,8 +219,24 @@ class Client(object):
             return None
 
         st.trim(starttime, endtime)
+        for trace in st:
+            if self.qc:
+                trace.stats.qc = trace_metrics(trace, starttime, endtime,
+                                               *gaps.get(trace.id, (0, 0)))
+            if np.ma.isMaskedArray(trace.data):
+                trace.data = trace.data.filled(0)
         return st
 
+    def _remove_response(self, stream, event):
+        """
+        Remove instrument response with response files at origin time.
+        """
+        pzfiles = {trace.id: self.response.get_response_file(
+                   trace.id, event["origin"]) for trace in stream}
+        return remove_response(stream, pzfiles, output=self.output,
+                               water_level=self.water_level,
+                               pre_filt=self.pre_filt)
+
     def _writesac(self, stream, event, station, outdir):
         """
         Write data with SAC format with event and station information.
@@ -194,6 +250,10 @@ class Client(object):
             sac_trace.stlo = station["stlo"]
             sac_trace.stel = station["stel"]
 
+            # physical unit after response removal
+            if trace.stats.get("output"):
+                sac_trace.idep = IDEP[trace.stats.output]
+
             if trace.stats.channel[-1] == "E":
                 sac_trace.cmpaz = 90
                 sac_trace.cmpinc = 90
@@ -203,9 +263,13 @@ class Client(object):
             elif trace.stats.channel[-1] == "Z":
                 sac_trace.cmpaz = 0
                 sac_trace.cmpinc = 0
-            else:
+            elif trace.stats.channel[-1] not in "RT":  # R|T after rotating
                 logger.warning("Not E|N|Z component")
 
+            # headers recording preprocessing
+            for key, value in trace.stats.get("preprocess", {}).items():
+                setattr(sac_trace, key, value)
+
             # set event related headers
             sac_trace.evla = event["latitude"]
             sac_trace.evlo = event["longitude"]
@@ -283,7 +347,7 @@ class Client(object):
         if not start_arrivals:  # no phase avaiable, skip this data
             return None, None  # starttime and endtime are None
 
-        end_arrivals = model.get_travel_times(
+        end_arrivals = self.model.get_travel_times(
             source_depth_in_km=event['depth'],
             distance_in_degree=dist,
             phase_list=end_ref_phase)
@@ -293,7 +357,8 @@ class Client(object):
         endtime = event['origin'] + end_arrivals[-1].time + end_offset
         return starttime, endtime
 
-    def get_waveform(self, event, by_event=None, by_phase=None, epicenter=None):
+    def get_waveform(self, event, by_event=None, by_phase=None, epicenter=None,
+                     stations=None, sacdir=None, preprocess=None):
         """
         Trim waveform from dataset of CGRM
 
@@ -307,10 +372,17 @@ class Client(object):
             Determine waveform window by phase arrival times
         epicenter: dict
             Select station location
+        stations: list
+            Only trim waveform of these stations (NET.STA)
+        sacdir: str
+            Directory of output instead of self.sacdir
+        preprocess: dict
+            Keyword arguments of lib.preprocess.preprocess, traces of all
+            stations are preprocessed together before writing
         """
         # check the destination
         eventdir = event['origin'].strftime("%Y%m%d%H%M%S")
-        outdir = os.path.join(self.sacdir, eventdir)
+        outdir = os.path.join(sacdir or self.sacdir, eventdir)
         if not os.path.exists(outdir):
             os.makedirs(outdir, exist_ok=True)
 
@@ -321,9 +393,15 @@ class Client(object):
             logger.debug("dirnames: %s", dirnames)
 
         # loop over all stations
+        qc_rows = []
+        collected = []
         for key, stationlist in self.stations.items():
+            if stations is not None and key not in stations:
+                continue
             station = find_station(stationlist, event['origin'])
             logger.debug("station: %s", key)
+            if station is None:
+                continue
             if not by_event:
                 starttime, endtime = self._get_window(event=event,
                                                       station=station,
@@ -339,7 +417,29 @@ class Client(object):
             st = self._read_mseed(station, dirnames, starttime, endtime)
             if not st:
                 continue
+            if self.output:
+                st = self._remove_response(st, event)
+                if not st:
+                    continue
+            if preprocess:
+                collected.append((st, station))
+                continue
             self._writesac(st, event, station, outdir)
+            if self.qc:
+                qc_rows.extend(written_metrics(trace) for trace in st)
+
+        if collected:
+            streams = [st for st, _ in collected]
+            preprocess_streams(streams, event,
+                               [station for _, station in collected],
+                               **preprocess)
+            for st, station in collected:
+                self._writesac(st, event, station, outdir)
+                if self.qc:
+                    qc_rows.extend(written_metrics(trace) for trace in st)
+
+        if qc_rows:
+            write_qc(os.path.join(outdir, QC_FILE), qc_rows)
 
 def find_station(stationlist, time):
     """Check the staion info. in a station list
@@ -373,41 +473,16 @@ def read_catalog(catalog):
     Example:
 
         2016-01-03T23:05:22.270  24.8036   93.6505  55.0 6.7  mww
+
+    See `lib.catalog.Catalog` to select events before reading.
     '''
-    events = []
-    with open(catalog) as f:
-        for line in f:
-            origin, latitude, longitude, depth, magnitude = line.split()[0:5]
-            event = {
-                "origin": UTCDateTime(origin),
-                "latitude": float(latitude),
-                "longitude": float(longitude),
-                "depth": float(depth),
-                "magnitude": float(magnitude),
-            }
-            events.append(event)
-    return events
+    return list(Catalog(catalog))
 
 
 if __name__ == '__main__':
-    client = Client(stationinfo="./info/station.info",
-                    mseeddir="/run/media/seispider/Seagate Backup Plus Drive/",
-                    sacdir="SAC",
-                    model="prem")
-
-    events = read_catalog("./info/catalog_2017_6.5.csv")
-    epicenter = {
-        "minimum": 30,
-        "maximum": 40
-    }
-    for event in tqdm(events):
-        logger.info("origin: %s", event['origin'])
-        by_event = {"start_offset": 0, "duration": 6000}
-        by_phase = {
-            "start_ref_phase": ['P', 'p'],
-            "start_offset": -100,
-            "end_ref_phase": ['PcP'],
-            "end_offset": 200
-        }
-
-        client.get_waveform(event, by_event=by_event)
+    # same as `python cgrm.py cut [options]`, e.g. `--shard 0/4` to share
+    # the catalog with other hosts
+    import sys
+    from cgrm import main
+
+    main(["cut"] + sys.argv[1:])